@@ -0,0 +1,227 @@
+from typing import Hashable, List, Tuple
+import numpy as np
+import random
+
+from chords import KEY_MOODS, CHORD_OFFSETS
+
+
+def chord_vocabulary(mood: str | None = None) -> List[Tuple[int, str]]:
+    """Lists chords as (number of half steps above the tonic, chord mood) pairs, the
+    same pairs as in `KEY_MOODS`
+
+    Args:
+        mood (str, optional): if given, only the diatonic chords of this mood, in
+        order. Otherwise, every kind of chord in `CHORD_OFFSETS` on every root,
+        which covers secondary dominants, augmented and borrowed chords.
+
+    Returns:
+        List[Tuple[int, str]]: the chords
+    """
+
+    if mood is not None:
+        return KEY_MOODS[mood][1:]
+
+    return [(root, chord_mood) for root in range(12) for chord_mood in CHORD_OFFSETS]
+
+
+def build_csr_table(contexts: np.ndarray, followers: np.ndarray, weights: np.ndarray) -> tuple:
+    """Packs (context, follower, weight) triples, sorted by context, into the
+    arrays of a compressed sparse row table, as described in `ChordModel`
+
+    Args:
+        contexts (np.ndarray): the packed context of each triple
+        followers (np.ndarray): the index of each follower
+        weights (np.ndarray): how likely each follower is after its context
+
+    Returns:
+        tuple: the (contexts, indptr, followers, cumulative) arrays
+    """
+
+    unique_contexts, starts = np.unique(contexts, return_index=True)
+    indptr = np.append(starts, len(contexts)).astype(np.int64)
+
+    # The smallest integer type that fits any follower index
+    follower_type = np.min_scalar_type(max(int(followers.max(initial=0)), 0))
+
+    return (
+        unique_contexts.astype(np.int64),
+        indptr,
+        followers.astype(follower_type),
+        np.cumsum(weights, dtype=np.float64),
+    )
+
+
+def sample_csr_row(table: tuple, context: int) -> int | None:
+    """Samples the index of a follower of a context from a table built by
+    `build_csr_table`, in proportion to the weights of its followers
+
+    Returns:
+        int | None: the follower index, or None if the context has no followers
+    """
+
+    contexts, indptr, followers, cumulative = table
+
+    row = np.searchsorted(contexts, context)
+    if row == len(contexts) or contexts[row] != context:
+        return None
+
+    start, end = indptr[row], indptr[row + 1]
+    low = cumulative[start - 1] if start > 0 else 0.0
+    total = cumulative[end - 1] - low
+
+    if total <= 0:
+        return None
+
+    p = low + random.random() * total
+    return int(followers[min(start + np.searchsorted(cumulative[start:end], p, side='right'), end - 1)])
+
+
+class ChordModel:
+    """A Markov model of chords of any order, over any vocabulary of chords.
+
+    Only the transitions that actually occur are stored, in compressed sparse row
+    form: for the contexts of each order, `contexts` holds the packed contexts
+    that occur, in order, and the followers of contexts[i] are
+    followers[indptr[i]:indptr[i + 1]]. `cumulative` holds the running total of
+    their weights, so a follower is sampled with a single binary search.
+
+    A context is packed by reading the indices of its chords in the vocabulary,
+    oldest first, as a number in base len(vocabulary). Contexts that never occurred
+    back off to shorter contexts, down to the overall frequency of each chord.
+    """
+
+    def __init__(self, vocabulary: List[Hashable], order: int, tables: list):
+        self.vocabulary = vocabulary
+        self.order = order
+        self.index = {chord: i for i, chord in enumerate(vocabulary)}
+
+        # tables[o] = (contexts, indptr, followers, cumulative) for contexts of o chords
+        self.tables = tables
+
+    @classmethod
+    def from_sequences(cls, sequences: List[List[Hashable]], order: int, vocabulary: List[Hashable] | None = None):
+        """Trains a model on some chord sequences
+
+        Args:
+            sequences (List[List[Hashable]]): the chord sequences, with chords given
+            as anything hashable, e.g. the numbers of `generate_chords` or the pairs
+            of `chord_vocabulary`
+            order (int): number of previous chords each transition depends on
+            vocabulary (List[Hashable], optional): every chord that may appear.
+            Defaults to the chords in the sequences, in order of appearance.
+
+        Returns:
+            ChordModel: the trained model
+        """
+
+        if vocabulary is None:
+            vocabulary = list(dict.fromkeys(chord for sequence in sequences for chord in sequence))
+
+        index = {chord: i for i, chord in enumerate(vocabulary)}
+        size = len(vocabulary)
+
+        if size ** (order + 1) >= 2 ** 63:
+            raise ValueError(f'contexts of {order} chords from {size} chords do not fit in 63 bits')
+
+        encoded = [np.array([index[chord] for chord in sequence], dtype=np.int64) for sequence in sequences]
+
+        tables = []
+
+        for o in range(order + 1):
+            pairs = []
+
+            for digits in encoded:
+                if len(digits) <= o:
+                    continue
+
+                # Pack each context together with the chord following it
+                packed = np.zeros(len(digits) - o, dtype=np.int64)
+                for j in range(o + 1):
+                    packed = packed * size + digits[j:j + len(packed)]
+
+                pairs.append(packed)
+
+            pairs, counts = np.unique(np.concatenate(pairs or [np.zeros(0, np.int64)]), return_counts=True)
+
+            tables.append(build_csr_table(pairs // size, pairs % size, counts.astype(np.float64)))
+
+        return cls(vocabulary, order, tables)
+
+    @classmethod
+    def from_matrix(cls, matrix: List[List[float]], vocabulary: List[Hashable], order: int = 1):
+        """Converts a dense transition matrix, such as one read by
+        `parse_transition_matrix` or written by `chord_trainer.py`, into a model
+
+        Args:
+            matrix (List[List[float]]): transition matrix with one row per context,
+            numbered as in the class description
+            vocabulary (List[Hashable]): the chords of the columns, e.g.
+            `list(range(1, 8))` for major.txt to keep the numbering of
+            `generate_chords`, or `chord_vocabulary('major')` for pairs that can be
+            mixed with chords outside the key
+            order (int, optional): number of previous chords in each context. Defaults to 1.
+
+        Returns:
+            ChordModel: the model, backing off to uniform probabilities
+        """
+
+        matrix = np.asarray(matrix, dtype=np.float64)
+        rows, followers = np.nonzero(matrix)
+
+        tables = [
+            build_csr_table(
+                np.zeros(len(vocabulary), dtype=np.int64),
+                np.arange(len(vocabulary)),
+                np.ones(len(vocabulary)),
+            )
+        ]
+
+        # Intermediate orders aren't known, so back off straight to uniform
+        for _ in range(1, order):
+            tables.append(build_csr_table(*np.zeros((3, 0), dtype=np.int64)))
+
+        tables.append(build_csr_table(rows, followers, matrix[rows, followers]))
+
+        return cls(vocabulary, order, tables)
+
+    def nbytes(self) -> int:
+        """Memory used by the transition tables, in bytes"""
+
+        return sum(array.nbytes for table in self.tables for array in table)
+
+    def next_chord_index(self, history: List[int]) -> int:
+        """Samples the index of the chord following the given chord indices"""
+
+        size = len(self.vocabulary)
+
+        for o in range(min(self.order, len(history)), -1, -1):
+            context = 0
+            for i in history[len(history) - o:]:
+                context = context * size + i
+
+            follower = sample_csr_row(self.tables[o], context)
+            if follower is not None:
+                return follower
+
+        raise ValueError('the model has no chords to sample from')
+
+    def generate(self, M: int, start: List[Hashable]) -> List[Hashable]:
+        """Generates chords following the given ones
+
+        Args:
+            M (int): number of chords to generate
+            start (List[Hashable]): the chords to continue, from the model's
+            vocabulary. To start on the tonic, that's [1] for chords numbered like
+            those of `generate_chords`, or [(0, 'major')] for the pairs of
+            `chord_vocabulary`.
+
+        Returns:
+            List[Hashable]: the starting chords followed by M generated chords
+        """
+
+        history = [self.index[chord] for chord in start]
+
+        for _ in range(M):
+            history.append(self.next_chord_index(history))
+
+        return [self.vocabulary[i] for i in history]
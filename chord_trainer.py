@@ -0,0 +1,270 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Tuple
+from pretty_midi import PrettyMIDI
+import numpy as np
+import argparse
+
+from chords import KEY_MOODS, CHORD_OFFSETS, write_transition_matrix
+from chord_model import ChordModel, chord_vocabulary
+from notes import notes_to_array
+
+
+def triad_templates(mood: str) -> np.ndarray:
+    """Builds the pitch class profile of each chord of a key whose tonic is C
+
+    Args:
+        mood (str): mood of the key ('major' or 'minor')
+
+    Returns:
+        np.ndarray: 7 by 12 array. Row i has a 1 on each pitch class in chord i + 1,
+        scaled so that the row has a length of 1
+    """
+
+    return chord_templates(chord_vocabulary(mood))
+
+
+def chord_templates(chords: List[Tuple[int, str]]) -> np.ndarray:
+    """Same as `triad_templates`, but for any (half steps above the tonic, chord mood)
+    pairs, like those of `chord_vocabulary`"""
+
+    templates = np.zeros((len(chords), 12))
+
+    for i, (root_pitch, chord_mood) in enumerate(chords):
+        middle_offset, top_offset = CHORD_OFFSETS[chord_mood]
+
+        for offset in 0, middle_offset, top_offset:
+            templates[i, (root_pitch + offset) % 12] = 1
+
+    return templates / np.sqrt(3)
+
+
+def beat_chroma(midi: PrettyMIDI) -> np.ndarray:
+    """Measures how long each pitch class sounds during each beat of a song
+
+    Args:
+        midi (PrettyMIDI): the song, of which drums are ignored
+
+    Returns:
+        np.ndarray: one row of 12 durations, in beats, per beat of the song
+    """
+
+    beats = midi.get_beats()
+    chroma = np.zeros((len(beats), 12))
+
+    if len(beats) == 0:
+        return chroma
+
+    # The last beat lasts as long as the one before it
+    beat_length = beats[-1] - beats[-2] if len(beats) > 1 else 1.0
+    bounds = np.append(beats, beats[-1] + beat_length)
+
+    notes = notes_to_array([
+        n for instrument in midi.instruments if not instrument.is_drum
+        for n in instrument.notes
+    ])
+
+    first = np.clip(np.searchsorted(bounds, notes['start'], side='right') - 1, 0, len(beats) - 1)
+    last = np.clip(np.searchsorted(bounds, notes['end'], side='left') - 1, 0, len(beats) - 1)
+    pitch_classes = notes['pitch'] % 12
+
+    # Most notes only cover a beat or two, so add up the overlap of every note with
+    # its first beat, then its second, and so on
+    for offset in range(int((last - first).max(initial=0)) + 1):
+        sounding = first + offset <= last
+        beat = np.minimum(first + offset, len(beats) - 1)
+
+        overlap = (
+            np.minimum(notes['end'], bounds[beat + 1])
+            - np.maximum(notes['start'], bounds[beat])
+        ) / (bounds[beat + 1] - bounds[beat])
+
+        np.add.at(
+            chroma,
+            (beat[sounding], pitch_classes[sounding]),
+            np.clip(overlap[sounding], 0, None),
+        )
+
+    return chroma
+
+
+def label_chords(chroma: np.ndarray, mood: str, extended: bool = False) -> List[int | Tuple[int, str]]:
+    """Names the chord sounding on each beat of a song, relative to its key
+
+    The tonic of the key is whichever one the chords of the mood fit best over the
+    whole song. Beats on which nothing sounds are skipped, and a chord held over
+    several beats is only listed once.
+
+    Args:
+        chroma (np.ndarray): beat chroma, as returned by `beat_chroma`
+        mood (str): mood of the song ('major' or 'minor')
+        extended (bool, optional): whether to match against every chord of
+        `chord_vocabulary()` rather than just the 7 in the key. Defaults to False.
+
+    Returns:
+        List[int | Tuple[int, str]]: sequence of numbers from 1-7, like those given
+        by `generate_chords`, or of chords of `chord_vocabulary()` if extended
+    """
+
+    norms = np.linalg.norm(chroma, axis=1)
+    chroma = chroma[norms > 0] / norms[norms > 0, None]
+
+    if len(chroma) == 0:
+        return []
+
+    templates = triad_templates(mood)
+
+    # Try every tonic by rotating the templates, i.e. transposing the chords up
+    # by that many half steps. similarity[tonic, beat, chord]
+    rotated = np.stack([np.roll(templates, tonic, axis=1) for tonic in range(12)])
+    similarity = np.einsum('bp,tcp->tbc', chroma, rotated)
+
+    tonic = similarity.max(axis=2).sum(axis=1).argmax()
+    labels = similarity[tonic].argmax(axis=1) + 1
+
+    if extended:
+        vocabulary = chord_vocabulary()
+        similarity = chroma @ np.roll(chord_templates(vocabulary), tonic, axis=1).T
+        labels = similarity.argmax(axis=1)
+
+    # Drop repeats of the same chord
+    keep = np.append(True, labels[1:] != labels[:-1])
+
+    if extended:
+        return [vocabulary[i] for i in labels[keep]]
+
+    return labels[keep].tolist()
+
+
+def count_transitions(chords: List[int], order: int) -> np.ndarray:
+    """Counts the chords following every context of the given order
+
+    Args:
+        chords (List[int]): sequence of numbers from 1-7
+        order (int): number of previous chords each transition depends on
+
+    Returns:
+        np.ndarray: 7^order by 7 array of counts. The row of a context is its chords,
+        minus one each, read as a base 7 number, oldest chord first
+    """
+
+    counts = np.zeros((7 ** order, 7), dtype=np.int64)
+
+    digits = np.asarray(chords, dtype=np.int64) - 1
+    if len(digits) <= order:
+        return counts
+
+    rows = np.zeros(len(digits) - order, dtype=np.int64)
+    for j in range(order):
+        rows = rows * 7 + digits[j:j + len(rows)]
+
+    np.add.at(counts, (rows, digits[order:]), 1)
+
+    return counts
+
+
+def file_chords(file: str, mood: str, extended: bool = False) -> List[int | Tuple[int, str]] | None:
+    """Runs `label_chords` on a MIDI file, or returns None if it can't be read"""
+
+    try:
+        midi = PrettyMIDI(file)
+    except Exception as e:
+        print(f'Skipping {file}: {e}')
+        return None
+
+    return label_chords(beat_chroma(midi), mood, extended)
+
+
+def file_transitions(file: str, mood: str, order: int) -> np.ndarray | None:
+    """Runs `count_transitions` on a MIDI file, or returns None if it can't be read"""
+
+    chords = file_chords(file, mood)
+    if chords is None:
+        return None
+
+    return count_transitions(chords, order)
+
+
+def train_transition_matrix(
+        files: List[str],
+        mood: str = 'major',
+        order: int = 1,
+        smoothing: float = 0.0,
+        workers: int | None = None,
+    ) -> List[List[float]]:
+    """Estimates a chord transition matrix from a collection of MIDI files
+
+    Args:
+        files (List[str]): paths of the MIDI files, all in the given mood
+        mood (str, optional): mood of the songs ('major' or 'minor'). Defaults to 'major'.
+        order (int, optional): number of previous chords each transition depends on.
+        Defaults to 1, which gives a matrix like those in major.txt and minor.txt.
+        smoothing (float, optional): count added to every transition. Defaults to 0.
+        workers (int, optional): number of processes to read files with. Defaults to
+        one per CPU.
+
+    Returns:
+        List[List[float]]: transition matrix with one row per context (see
+        `count_transitions`). Contexts never seen are given a uniform row.
+    """
+
+    counts = np.zeros((7 ** order, 7), dtype=np.float64)
+
+    with ProcessPoolExecutor(workers) as pool:
+        for file_counts in pool.map(
+                partial(file_transitions, mood=mood, order=order), files, chunksize=16):
+            if file_counts is not None:
+                counts += file_counts
+
+    counts += smoothing
+
+    totals = counts.sum(axis=1, keepdims=True)
+    matrix = np.divide(counts, totals, out=np.full_like(counts, 1 / 7), where=totals > 0)
+
+    return matrix.tolist()
+
+
+def train_chord_model(
+        files: List[str],
+        mood: str = 'major',
+        order: int = 3,
+        workers: int | None = None,
+    ) -> ChordModel:
+    """Trains a sparse chord model over every chord of `chord_vocabulary()` from a
+    collection of MIDI files
+
+    Args:
+        files (List[str]): paths of the MIDI files, all in the given mood
+        mood (str, optional): mood of the songs ('major' or 'minor'). Defaults to 'major'.
+        order (int, optional): number of previous chords each transition depends on.
+        Defaults to 3.
+        workers (int, optional): number of processes to read files with. Defaults to
+        one per CPU.
+
+    Returns:
+        ChordModel: the trained model
+    """
+
+    with ProcessPoolExecutor(workers) as pool:
+        sequences = [
+            chords for chords in pool.map(
+                partial(file_chords, mood=mood, extended=True), files, chunksize=16)
+            if chords is not None
+        ]
+
+    return ChordModel.from_sequences(sequences, order, chord_vocabulary())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Learn a chord transition matrix from MIDI files')
+    parser.add_argument('out_file', help='where to write the matrix, e.g. major.txt')
+    parser.add_argument('files', nargs='+', help='MIDI files to learn from')
+    parser.add_argument('--mood', default='major', choices=list(KEY_MOODS))
+    parser.add_argument('--order', type=int, default=1)
+    parser.add_argument('--smoothing', type=float, default=0.0)
+    parser.add_argument('--workers', type=int)
+
+    args = parser.parse_args()
+
+    matrix = train_transition_matrix(args.files, args.mood, args.order, args.smoothing, args.workers)
+    write_transition_matrix(args.out_file, matrix)
@@ -1,8 +1,48 @@
-from typing import List
+from typing import Dict, Iterable, List, Tuple
 from pretty_midi import Note
+import numpy as np
 import random
 
 
+# KEY_MOODS[mood][chord] = (number of half steps above the tonic, chord mood)
+# i.e. KEY_MOODS['major'][3] = (major 3rd is 4 half steps, iii chord is minor)
+KEY_MOODS = {
+    'major': [
+        None,
+        (0, 'major'),
+        (2, 'minor'),
+        (4, 'minor'),
+        (5, 'major'),
+        (7, 'major'),
+        (9, 'minor'),
+        (11, 'dim'),
+    ],
+    'minor': [
+        None,
+        (0, 'minor'),
+        (2, 'dim'),
+        (3, 'major'),
+        (5, 'minor'),
+        (7, 'major'),
+        (8, 'major'),
+        (10, 'major'),
+    ]
+}
+
+# Number of half steps above the root for the middle and top notes of the chord,
+# respectively
+CHORD_OFFSETS = {
+    # 4: major 3rd, 7: perfect 5th
+    'major': (4, 7),
+    # 3: minor 3rd, 7: perfect 5th
+    'minor': (3, 7),
+    # 3: minor 3rd: 6: diminished 5th
+    'dim': (3, 6),
+    # 4: major 3rd: 8: augmented 5th
+    'aug': (4, 8),
+}
+
+
 def parse_transition_matrix(file: str) -> List[List[float]]:
 
     matrix = []
@@ -14,6 +54,21 @@ def parse_transition_matrix(file: str) -> List[List[float]]:
     return matrix
 
 
+def write_transition_matrix(file: str, matrix: List[List[float]]):
+    """Writes a transition matrix in the format read by `parse_transition_matrix`
+
+    Args:
+        file (str): path of the file to write
+        matrix (List[List[float]]): transition matrix, one row per line
+    """
+
+    # Written in full, since `generate_chords` can come up short on rows that
+    # rounding has left summing to less than 1
+    with open(file, 'w') as f:
+        for row in matrix:
+            f.write('\t'.join(repr(float(p)) for p in row) + '\n')
+
+
 def generate_chords(matrix: List[List[float]], M: int) -> List[int]:
     """Generates chords in a Markovian process using the supplied transition matrix
 
@@ -45,15 +100,173 @@ def generate_chords(matrix: List[List[float]], M: int) -> List[int]:
     return output
 
 
+def generate_chords_batch(
+        matrix: List[List[float]],
+        M: int,
+        n: int,
+        rng: np.random.Generator | None = None,
+    ) -> np.ndarray:
+    """Same as `generate_chords`, but generates n sequences at once, taking each
+    step of every sequence together
+
+    Args:
+        matrix (List[List[float]]): transition matrix used
+        M (int): number of chords to generate
+        n (int): number of sequences to generate
+        rng (np.random.Generator, optional): source of randomness. Defaults to a
+        freshly seeded generator.
+
+    Returns:
+        np.ndarray: n by M + 1 array of numbers from 1-7, each row a sequence
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    # Rows of the text files don't always sum to exactly 1, so normalize them
+    cumulative = np.cumsum(matrix, axis=1)
+    cumulative /= cumulative[:, -1:]
+
+    output = np.ones((n, M + 1), dtype=np.uint8)
+
+    for step in range(M):
+
+        rows = cumulative[output[:, step] - 1]
+        p = rng.random(n)
+
+        # The chosen chord is the first one whose cumulative probability exceeds p
+        output[:, step + 1] = (rows <= p[:, None]).sum(axis=1) + 1
+
+    return output
+
+
+def backward_messages(
+        matrix: List[List[float]],
+        M: int,
+        constraints: Dict[int, int | Iterable[int]],
+    ) -> np.ndarray:
+    """Precomputes the tables `sample_constrained_chords` needs to generate chords
+    that meet some constraints
+
+    Entry [t, c] is proportional to the probability that a sequence which has chord
+    c + 1 at position t goes on to meet every constraint after t. They are built
+    from the end backwards, one matrix-vector product per position.
+
+    Args:
+        matrix (List[List[float]]): transition matrix used
+        M (int): number of chords to generate after the first
+        constraints (Dict[int, int | Iterable[int]]): maps positions, from 0 to M,
+        to the chord (or chords) allowed there. For example, {M: 1} ends on the tonic.
+
+    Returns:
+        np.ndarray: M + 1 by 7 array of backward messages
+    """
+
+    # Rows of the text files don't always sum to exactly 1, so normalize them
+    transitions = np.asarray(matrix, dtype=np.float64)
+    transitions = transitions / transitions.sum(axis=1, keepdims=True)
+
+    allowed = np.ones((M + 1, len(transitions)))
+
+    for position, chords in constraints.items():
+        if not 0 <= position <= M:
+            raise ValueError(f'constraint at position {position} is outside of 0-{M}')
+
+        if isinstance(chords, (int, np.integer)):
+            chords = [chords]
+
+        chords = [int(chord) for chord in chords]
+
+        for chord in chords:
+            if not 1 <= chord <= len(transitions):
+                raise ValueError(f'constraint chord {chord} is outside of 1-{len(transitions)}')
+
+        allowed[position] = 0
+        allowed[position, [chord - 1 for chord in chords]] = 1
+
+    messages = np.empty_like(allowed)
+    messages[M] = allowed[M]
+
+    for t in range(M - 1, -1, -1):
+        messages[t] = allowed[t] * (transitions @ messages[t + 1])
+
+        # Rescale so that long sequences don't underflow. Only the ratios within a
+        # row matter when sampling.
+        total = messages[t].sum()
+        if total > 0:
+            messages[t] /= total
+
+    return messages
+
+
+def sample_constrained_chords(matrix: List[List[float]], messages: np.ndarray) -> List[int]:
+    """Generates chords like `generate_chords`, but only ever sequences that meet the
+    constraints the backward messages were built for. Each sequence is drawn with
+    the same probability as it would have by generating chords until one happened
+    to meet the constraints.
+
+    Args:
+        matrix (List[List[float]]): transition matrix used, the same one as was given
+        to `backward_messages`
+        messages (np.ndarray): tables returned by `backward_messages`
+
+    Returns:
+        List[int]: sequence of numbers from 1-7, starting at 1, of length M + 1
+    """
+
+    transitions = np.asarray(matrix, dtype=np.float64)
+
+    if messages[0, 0] == 0:
+        raise ValueError('no sequence starting on the tonic meets the constraints')
+
+    output = [1]
+
+    for t in range(1, len(messages)):
+
+        weights = transitions[output[-1] - 1] * messages[t]
+        cumulative = np.cumsum(weights)
+
+        p = random.random() * cumulative[-1]
+
+        output.append(int(np.searchsorted(cumulative, p, side='right')) + 1)
+
+    return output
+
+
+def generate_constrained_chords(
+        matrix: List[List[float]],
+        M: int,
+        constraints: Dict[int, int | Iterable[int]] | None = None,
+    ) -> List[int]:
+    """Generates chords in a Markovian process that meet the given constraints
+
+    Args:
+        matrix (List[List[float]]): transition matrix used
+        M (int): number of chords to generate
+        constraints (Dict[int, int | Iterable[int]], optional): see `backward_messages`.
+        Defaults to ending on the tonic.
+
+    Returns:
+        List[int]: sequence of numbers from 1-7, starting at 1, of length M + 1
+    """
+
+    if constraints is None:
+        constraints = {M: 1}
+
+    return sample_constrained_chords(matrix, backward_messages(matrix, M, constraints))
+
+
 def chords_to_midi_pitches(
-        chords: List[int],
+        chords: List[int | Tuple[int, str]],
         tonic_midi: int = 48,
         mood: str = 'major',
     ) -> List[Note]:
     """Converts a list of chords into a list of MIDI notes
 
     Args:
-        chords (List[int]): list of chords, perhaps outputted by `generate_chords`
+        chords (List[int | Tuple[int, str]]): list of chords, perhaps outputted by
+        `generate_chords`. Chords outside the key can be given as (number of half
+        steps above the tonic, chord mood) pairs, like those in `KEY_MOODS`.
         tonic_midi (int, optional): the MIDI note to use as the tonic. Defaults to 48 (C3).
         mood (str, optional): mood of the chords ('major' or 'minor'). Defaults to 'major'.
 
@@ -61,51 +274,16 @@ def chords_to_midi_pitches(
         List[Note]: _description_
     """
 
-    # key_moods[mood][chord] = (number of half steps above the tonic, chord mood)
-    # i.e. key_moods['major'][3] = (major 3rd is 4 half steps, iii chord is minor)
-    key_moods = {
-        'major': [
-            None,
-            (0, 'major'),
-            (2, 'minor'),
-            (4, 'minor'),
-            (5, 'major'),
-            (7, 'major'),
-            (9, 'minor'),
-            (11, 'dim'),
-        ],
-        'minor': [
-            None,
-            (0, 'minor'),
-            (2, 'dim'),
-            (3, 'major'),
-            (5, 'minor'),
-            (7, 'major'),
-            (8, 'major'),
-            (10, 'major'),
-        ]
-    }
-
-    # Number of half steps above the root for the middle and top notes of the chord,
-    # respectively
-    chord_offsets = {
-        # 4: major 3rd, 7: perfect 5th
-        'major': (4, 7),
-        # 3: minor 3rd, 7: perfect 5th
-        'minor': (3, 7),
-        # 3: minor 3rd: 6: diminished 5th
-        'dim': (3, 6),
-        # 4: major 3rd: 8: augmented 5th
-        'aug': (4, 8),
-    }
-
     notes_list = []
 
     for chord in chords:
 
         # Figure out the offsets for the middle and top chords
-        root_pitch, chord_mood = key_moods[mood][chord]
-        middle_offset, top_offset = chord_offsets[chord_mood]
+        if isinstance(chord, tuple):
+            root_pitch, chord_mood = chord
+        else:
+            root_pitch, chord_mood = KEY_MOODS[mood][chord]
+        middle_offset, top_offset = CHORD_OFFSETS[chord_mood]
 
         # Generate the pitches for the three notes
         root = tonic_midi + root_pitch
@@ -0,0 +1,267 @@
+from typing import Dict, List
+import numpy as np
+import random
+
+from notes import NOTE_DTYPE, encode_rhythm
+from rhythm import fill_gap
+
+
+def midi_to_grid(
+        midi_notes: np.ndarray,
+        beats: List[float],
+        drum_pitches: List[int],
+        subdivisions: int = 4,
+    ) -> np.ndarray:
+    """Converts drum notes into a grid of bitmasks, one per subdivision of the beat.
+    Bit i of a step is set when drum_pitches[i] is struck on that step.
+
+    Args:
+        midi_notes (np.ndarray): note array (see `notes.py`) containing the drums
+        beats (List[float]): list of beats used to interpret the rhythm
+        drum_pitches (List[int]): the MIDI pitches of the drums to keep, one voice each
+        subdivisions (int, optional): number of grid steps per beat. Defaults to 4
+        (sixteenth notes).
+
+    Returns:
+        np.ndarray: one bitmask per grid step, starting at the first step on which
+        any of the drums sound
+    """
+
+    dtype = np.min_scalar_type((1 << len(drum_pitches)) - 1)
+
+    notes = midi_notes[np.isin(midi_notes['pitch'], drum_pitches)]
+
+    if len(notes) == 0:
+        return np.zeros(0, dtype=dtype)
+
+    # Find which step of the grid every note falls on
+    beat_positions = np.interp(notes['start'], beats, np.arange(len(beats)))
+    steps = np.rint(beat_positions * subdivisions).astype(np.int64)
+    steps -= steps.min()
+
+    grid = np.zeros(steps.max() + 1, dtype=dtype)
+
+    for voice, pitch in enumerate(drum_pitches):
+        np.bitwise_or.at(grid, steps[notes['pitch'] == pitch], dtype.type(1 << voice))
+
+    return grid
+
+
+def pack_contexts(grid: np.ndarray, k: int, n_voices: int) -> np.ndarray:
+    """Packs every run of k consecutive grid steps into a single integer, oldest
+    step in the most significant bits. Entry i is the context of grid[i:i+k].
+
+    Args:
+        grid (np.ndarray): grid of bitmasks, as returned by `midi_to_grid`
+        k (int): number of steps per context
+        n_voices (int): number of bits used by each step
+
+    Returns:
+        np.ndarray: the packed contexts, of length len(grid) - k + 1
+    """
+
+    if k * n_voices > 63:
+        raise ValueError(f'a context of {k} steps of {n_voices} voices does not fit in 63 bits')
+
+    contexts = np.zeros(max(len(grid) - k + 1, 0), dtype=np.int64)
+
+    for j in range(k):
+        contexts <<= n_voices
+        contexts |= grid[j:j + len(contexts)]
+
+    return contexts
+
+
+def collect_grid_counts(grid: np.ndarray, k: int, n_voices: int) -> Dict[int, dict]:
+    """Builds the same count dictionary as `rhythm.collect_counts`, except that the
+    keys are k grid steps packed into one integer by `pack_contexts`.
+
+    Args:
+        grid (np.ndarray): grid of bitmasks, as returned by `midi_to_grid`
+        k (int): order of the Markov chain
+        n_voices (int): number of drum voices in the grid
+
+    Returns:
+        Dict[int, dict]: maps each packed context to a dictionary of its count and
+        the counts of its followers
+    """
+
+    # Each context is packed together with its follower below, which takes another
+    # n_voices bits on top of those of the context
+    if (k + 1) * n_voices > 63:
+        raise ValueError(f'a context of {k} steps of {n_voices} voices and its follower do not fit in 63 bits')
+
+    # The last context has no follower, so it isn't counted
+    contexts = pack_contexts(grid, k, n_voices)[:-1]
+    followers = grid[k:].astype(np.int64)
+
+    # Count every (context, follower) pair at once by packing them together too
+    pairs, pair_counts = np.unique((contexts << n_voices) | followers, return_counts=True)
+
+    counts = {}
+
+    for pair, pair_count in zip(pairs.tolist(), pair_counts.tolist()):
+        context = pair >> n_voices
+        follower = pair & ((1 << n_voices) - 1)
+
+        try:
+            k_tuple_count_dict = counts[context]
+        except KeyError:
+            k_tuple_count_dict = {
+                'count': 0,
+                'followers': dict(),
+            }
+            counts[context] = k_tuple_count_dict
+
+        k_tuple_count_dict['count'] += pair_count
+        k_tuple_count_dict['followers'][follower] = pair_count
+
+    return counts
+
+
+def generate_grid(M: int, k: int, n_voices: int, seed: np.ndarray) -> np.ndarray:
+    """Generates a drum grid designed to continue that which is passed as a seed.
+    All voices are sampled together, one step at a time.
+
+    Args:
+        M (int): the number of steps in the continuation
+        k (int): order of the Markov chain used to generate the grid
+        n_voices (int): number of drum voices in the grid
+        seed (np.ndarray): grid on which the Markov model is trained
+
+    Returns:
+        np.ndarray: generated grid, which will be of length k + M
+    """
+
+    if len(seed) < k + 1:
+        raise ValueError(f'a seed of {len(seed)} steps is too short to train an order {k} model')
+
+    counts = collect_grid_counts(seed, k, n_voices)
+
+    return sample_grid(M, k, n_voices, counts, seed[:k])
+
+
+def sample_grid(
+        M: int,
+        k: int,
+        n_voices: int,
+        counts: Dict[int, dict],
+        start: np.ndarray,
+    ) -> np.ndarray:
+    """Samples from an already trained drum model
+
+    Args:
+        M (int): the number of steps in the continuation
+        k (int): order of the Markov chain
+        n_voices (int): number of drum voices in the grid
+        counts (Dict[int, dict]): the model, as returned by `collect_grid_counts`
+        start (np.ndarray): the first k steps of the grid the model was trained on
+
+    Returns:
+        np.ndarray: generated grid, which will be of length k + M
+    """
+
+    if len(start) != k:
+        raise ValueError(f'start must be exactly {k} steps, not {len(start)}')
+
+    context_mask = (1 << (k * n_voices)) - 1
+    first_context = int(pack_contexts(start, k, n_voices)[0])
+
+    if first_context not in counts:
+        raise ValueError('start is never followed by anything in the model')
+
+    grid = np.zeros(k + M, dtype=start.dtype)
+    grid[:k] = start
+    context = first_context
+
+    for i in range(k, k + M):
+
+        # The end of the training grid may never have been followed by anything, in
+        # which case we start again from its beginning
+        if context not in counts:
+            context = first_context
+
+        k_tuple_entry = counts[context]
+
+        total_counts = k_tuple_entry['count']
+        counts_dict = k_tuple_entry['followers']
+
+        # Same as in `generate_rhythm`
+        number = random.randint(0, total_counts - 1)
+
+        for follower, follower_count in counts_dict.items():
+
+            number -= follower_count
+
+            if number < 0:
+                break
+
+        grid[i] = follower
+        context = ((context << n_voices) | follower) & context_mask
+
+    return grid
+
+
+def grid_to_note_array(
+        grid: np.ndarray,
+        drum_pitches: List[int],
+        tempo: int,
+        subdivisions: int = 4,
+        velocity: int = 60,
+    ) -> np.ndarray:
+    """Converts a drum grid back into notes
+
+    Args:
+        grid (np.ndarray): grid of bitmasks, as returned by `midi_to_grid`
+        drum_pitches (List[int]): the MIDI pitch of each voice
+        tempo (int): tempo in beats per minute
+        subdivisions (int, optional): number of grid steps per beat. Defaults to 4.
+        velocity (int, optional): velocity of every note. Defaults to 60.
+
+    Returns:
+        np.ndarray: note array (see `notes.py`), sorted by start time. Every note
+        lasts one step.
+    """
+
+    step_s = 60 / (tempo * subdivisions)
+
+    voice_masks = np.array([1 << voice for voice in range(len(drum_pitches))], dtype=grid.dtype)
+    steps, voices = np.nonzero(grid[:, None] & voice_masks)
+
+    notes = np.zeros(len(steps), dtype=NOTE_DTYPE)
+    notes['start'] = steps * step_s
+    notes['end'] = notes['start'] + step_s
+    notes['pitch'] = np.asarray(drum_pitches)[voices]
+    notes['velocity'] = velocity
+
+    return notes
+
+
+def grid_to_rhythm(grid: np.ndarray, subdivisions: int = 4) -> np.ndarray:
+    """Converts a drum grid into a rhythm with a note wherever any of the drums
+    sound, each held until the next one
+
+    Args:
+        grid (np.ndarray): grid of bitmasks, as returned by `midi_to_grid`
+        subdivisions (int, optional): number of grid steps per beat. Defaults to 4.
+
+    Returns:
+        np.ndarray: rhythm token array (see `notes.py`)
+    """
+
+    # Rhythm tokens count 8 subdivisions to the beat
+    step_subdivs = 8 // subdivisions
+
+    onsets = np.flatnonzero(grid).tolist()
+
+    tokens = []
+
+    # Rest until the first onset
+    if onsets:
+        tokens += fill_gap(onsets[0] * step_subdivs, 0)
+
+    for onset, next_onset in zip(onsets, onsets[1:] + [len(grid)]):
+        length = (next_onset - onset) * step_subdivs
+        tokens += fill_gap(length, length)
+
+    return encode_rhythm(tokens)
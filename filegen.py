@@ -1,7 +1,11 @@
 from typing import List
+import math
 from pydub import AudioSegment
 from pydub.generators import Sine
 from pretty_midi import Note
+import numpy as np
+
+from notes import NOTE_DTYPE, array_to_notes, iter_rhythm
 
 def get_frequency(midi_note: int):
 
@@ -29,8 +33,8 @@ def get_frequency(midi_note: int):
 def make_wav(
         tempo: int,
         file_name: str,
-        rhythm: List[str],
-        pitches: List[int],
+        rhythm: List[str] | np.ndarray,
+        pitches: List[int | List[int]] | np.ndarray,
         transpose: int = 0
     ):
 
@@ -41,18 +45,7 @@ def make_wav(
     # Get the tempo in terms of subdivisions per millisecond
     tempo_ms_subdivs = (60 * 1000) / (8 * tempo)
 
-    for note in rhythm:
-        duration_name, kind = note.split('_')
-
-        match duration_name:
-            case 'whole': duration_subdivs = 32
-            case 'half': duration_subdivs = 16
-            case 'quarter': duration_subdivs = 8
-            case 'eighth': duration_subdivs = 4
-            case 'sixteenth': duration_subdivs = 2
-            case 'thirty-second': duration_subdivs = 1
-            case x: raise ValueError(f'unknown note {x}')
-
+    for duration_subdivs, kind in iter_rhythm(rhythm):
 
         duration_ms = tempo_ms_subdivs * duration_subdivs
 
@@ -60,16 +53,25 @@ def make_wav(
             segment = AudioSegment.silent(duration=duration_ms)
         elif kind in ('tie', 'note'):
 
-            segment = Sine(
-                get_frequency(pitches[pitch_idx] + transpose)
-            ).to_audio_segment(duration=duration_ms)
+            pitches_here = pitches[pitch_idx]
+
+            # If only one pitch is supplied, convert that one pitch into a list
+            if isinstance(pitches_here, (int, np.integer)):
+                pitches_here = [pitches_here]
+
+            # Quieten chords so that the sum of their notes doesn't clip
+            volume = -20 * math.log10(len(pitches_here))
+
+            segment = AudioSegment.silent(duration=duration_ms)
+
+            for pitch in pitches_here:
+                segment = segment.overlay(Sine(
+                    get_frequency(int(pitch) + transpose)
+                ).to_audio_segment(duration=duration_ms, volume=volume))
             
             if kind == 'note':
                 pitch_idx += 1
 
-        else:
-            raise ValueError('invalid note type')
-
         wav += segment
 
     wav.export(file_name, format="wav")
@@ -77,60 +79,63 @@ def make_wav(
 
 def make_midi_note_list(
         tempo: int,
-        rhythm: List[str],
-        pitches: List[int | List[int]]
+        rhythm: List[str] | np.ndarray,
+        pitches: List[int | List[int]] | np.ndarray
     ) -> List[Note]:
 
+    return array_to_notes(make_note_array(tempo, rhythm, pitches))
+
+
+def make_note_array(
+        tempo: int,
+        rhythm: List[str] | np.ndarray,
+        pitches: List[int | List[int]] | np.ndarray
+    ) -> np.ndarray:
+    """Same as `make_midi_note_list`, but returns a note array (see `notes.py`)"""
+
     tempo_s_subdivs = 60 / (8 * tempo)
 
-    notes_list = []
+    starts = []
+    ends = []
+    note_pitches = []
 
     start = 0.0
     pitch_count = 0
 
-    for note in rhythm:
-        duration_name, kind = note.split('_')
-
-        match duration_name:
-            case 'whole': duration_subdivs = 32
-            case 'half': duration_subdivs = 16
-            case 'quarter': duration_subdivs = 8
-            case 'eighth': duration_subdivs = 4
-            case 'sixteenth': duration_subdivs = 2
-            case 'thirty-second': duration_subdivs = 1
-            case x: raise ValueError(f'unknown note {x}')
+    for duration_subdivs, kind in iter_rhythm(rhythm):
 
         duration_s = tempo_s_subdivs * duration_subdivs
 
         # Continue to write to the previous note
         if kind == 'tie':
 
-            if notes_list:
-                notes_list[-1].end += duration_s
+            if ends:
+                ends[-1] += duration_s
 
-        elif kind in ('rest', 'note'):
+        # Create a new note
+        elif kind == 'note':
+                
+            pitches_here = pitches[pitch_count]
 
-            # Create a new note
-            if kind == 'note':
-                    
-                pitches_here = pitches[pitch_count]
-
-                # If only one pitch is supplied, convert that one pitch into a list
-                if type(pitches_here) is int:
-                    pitches_here = [pitches_here]
+            # If only one pitch is supplied, convert that one pitch into a list
+            if isinstance(pitches_here, (int, np.integer)):
+                pitches_here = [pitches_here]
 
-                for pitch in pitches_here:
-                    notes_list.append(
-                        Note(velocity=60, pitch=pitch, start=start, end=start+duration_s)
-                    )
+            for pitch in pitches_here:
+                starts.append(start)
+                ends.append(start + duration_s)
+                note_pitches.append(pitch)
 
-                # Move to the next list of pitches
-                pitch_count += 1
-
-        else:
-            raise ValueError('invalid note type')
+            # Move to the next list of pitches
+            pitch_count += 1
 
         # Update the note start positions
         start += duration_s
 
-    return notes_list
+    notes = np.zeros(len(starts), dtype=NOTE_DTYPE)
+    notes['start'] = starts
+    notes['end'] = ends
+    notes['pitch'] = note_pitches
+    notes['velocity'] = 60
+
+    return notes
@@ -1,3 +1,5 @@
+import mmap
+import os
 import random
 import textwrap
 
@@ -43,25 +45,13 @@ def generate_mm_text(file_name, order, M):
     Returns:
         A string of randomly generated text using a Markov model
     """
-    # Read the contents of the file
-    f = open(file_name, "r")
-
-    if f is None:
-        print("Can't open " + file_name)
-    else:
-        contents = f.read()
-        f.close()
-        contents = contents.replace("\n", "")
-        contents = contents.replace("\r", "")
-
     # Collect the counts necessary to estimate transition probabilities
     # This dictionary will store all the data needed to estimate the Markov model:
-    txt_dict = collect_counts(contents, order)
+    txt_dict, seed = collect_counts_from_file(file_name, order)
 
     # display_dict(txt_dict)
 
     # Generate artificial text from the trained model
-    seed = contents[0:order]
     text = seed
 
     for _ in range(M):
@@ -69,6 +59,10 @@ def generate_mm_text(file_name, order, M):
         text += next_character
         seed = seed[1:] + next_character
 
+    # The model was trained on bytes (see `collect_counts_from_file`), so turn them
+    # back into proper characters
+    text = text.encode('latin-1').decode('utf-8', errors='replace')
+
     text_list = textwrap.wrap(text, 72)
     text = "\n".join(text_list)
 
@@ -146,13 +140,61 @@ def build_dict(contents, k):
     return counts
 
 
-def collect_counts(contents, k):
+def collect_counts_from_file(file_name, k, chunk_size=1 << 24):
+    """Run `collect_counts` over a whole file without ever holding all of it in
+    memory. The file is memory-mapped and read chunk_size bytes at a time, with
+    newlines stripped out of each chunk as it is read.
+
+    Counting is done on bytes, each stored as the character with the same code
+    (i.e. decoded as latin-1), so a multi-byte UTF-8 character counts as several
+    characters.
+
+    Args:
+        file_name (str): path of the text to process
+        k (int): number of characters in the substring
+        chunk_size (int): number of bytes of the file to read at once
+
+    Returns:
+        the dictionary returned by `collect_counts` for the file with newlines
+        removed, and the first k characters of that text to use as a seed
+    """
+    counts = {}
+    seed = ''
+
+    # The last k characters of the previous chunk, so that the k-tuples running
+    # over the boundary between two chunks get counted
+    carry = ''
+
+    with open(file_name, 'rb') as f:
+
+        # Empty files can't be memory-mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return counts, seed
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start in range(0, len(mm), chunk_size):
+                chunk = mm[start:start + chunk_size].translate(None, b'\r\n')
+
+                contents = carry + chunk.decode('latin-1')
+                collect_counts(contents, k, counts)
+
+                if len(seed) < k:
+                    seed = contents[:k]
+
+                carry = contents[max(len(contents) - k, 0):]
+
+    return counts, seed
+
+
+def collect_counts(contents, k, counts=None):
     """Build a k-tuple dictionary mapping from k-tuple to a dictionary of
     of counts and dictionary of follower counts.
     
     Args:
         contents (str): the string contents of to count
         k (int): number of characters in the substring
+        counts (dict): dictionary previously returned by `collect_counts` to add
+        the counts to, rather than starting a new one
 
     Returns:
         a dictionary mapping k-tuple to a dictionary of counts and dictionary
@@ -174,7 +216,8 @@ def collect_counts(contents, k):
     our auto-grader will test the behavior of `build_dict` so that function 
     does need to work properly.
     """
-    counts = {}
+    if counts is None:
+        counts = {}
 
     # In order to not consider the last complete k-tuple (which would be the interval
     # [l-k, l), where l is the length of contents), the last tuple we consider is l-k-1,
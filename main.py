@@ -2,8 +2,10 @@ from typing import List
 from pretty_midi import PrettyMIDI, Instrument
 
 from chords import parse_transition_matrix, chords_to_midi_pitches, generate_chords
-from rhythm import midi_to_list, generate_rhythm
+from rhythm import midi_to_list, midi_to_array, generate_rhythm
 from filegen import make_midi_note_list, make_wav
+from notes import notes_to_array, group_by_pitch, array_to_notes
+from drums import midi_to_grid, generate_grid, grid_to_note_array, grid_to_rhythm
 
 
 def main():
@@ -32,22 +34,14 @@ def chords_with_rhythms(out_file: str, tonic: int, mood: str):
 
     instrument = midi.instruments[0]
 
-    pitched_notes = []
+    drum_pitches = [35, 38, 42]
 
-    for i in range(100):
-        pitched_notes.append([n for n in instrument.notes if n.pitch == i])
+    # Model the kick, snare and hi-hat together, then play a chord wherever any
+    # of them would sound
+    grid = midi_to_grid(notes_to_array(instrument.notes), midi.get_beats(), drum_pitches)
 
-    print([(i, len(p)) for i, p in enumerate(pitched_notes)])
-
-    beats = midi.get_beats()
-
-    parsed_notes35, _ = midi_to_list(pitched_notes[35], beats)
-    parsed_notes38, _ = midi_to_list(pitched_notes[38], beats)
-    parsed_notes42, _ = midi_to_list(pitched_notes[42], beats)
-
-    rhythm_aggregate = parsed_notes35 + parsed_notes38 + parsed_notes42
-
-    markoved_rhythm = generate_rhythm(300, 2, rhythm_aggregate)
+    markoved_grid = generate_grid(300, 8, len(drum_pitches), grid)
+    markoved_rhythm = grid_to_rhythm(markoved_grid)
 
     matrix = parse_transition_matrix(f'{mood}.txt')
     markoved_chords = chords_to_midi_pitches(generate_chords(matrix, 1000), tonic_midi=tonic, mood=mood)
@@ -69,7 +63,7 @@ def i_cant_quote_nick():
 
 
 def reasonable_chords_and_rhythms(tonic: int, mood: str):
-    chords_and_rhythms_separate('simple_drum_beats.mid', [35, 38, 42], 'drums.mid', tonic, mood)
+    chords_and_rhythms_joint('simple_drum_beats.mid', [35, 38, 42], 'drums.mid', tonic, mood)
 
 
 def chords_and_rhythms_separate(in_file: str, drum_pitches: List[int], out_file: str, tonic: int, mood: str):
@@ -77,19 +71,16 @@ def chords_and_rhythms_separate(in_file: str, drum_pitches: List[int], out_file:
 
     instrument = midi.instruments[0]
 
-    pitched_notes = []
-
-    for i in range(100):
-        pitched_notes.append([n for n in instrument.notes if n.pitch == i])
+    pitched_notes = group_by_pitch(notes_to_array(instrument.notes))
 
-    print([(i, len(p)) for i, p in enumerate(pitched_notes)])
+    print([(i, len(p)) for i, p in pitched_notes.items()])
 
     beats = midi.get_beats()
 
     notes = []
 
     for p in drum_pitches:
-        parsed_notes, _ = midi_to_list(pitched_notes[p], beats)
+        parsed_notes, _ = midi_to_array(pitched_notes[p], beats)
         markoved = generate_rhythm(300, 3, parsed_notes)
         notes += make_midi_note_list(tempo=120, rhythm=markoved, 
                                  pitches=[p for _ in range(10000)])
@@ -111,6 +102,36 @@ def chords_and_rhythms_separate(in_file: str, drum_pitches: List[int], out_file:
     out.write(out_file)
 
 
+def chords_and_rhythms_joint(in_file: str, drum_pitches: List[int], out_file: str, tonic: int, mood: str):
+    """Like `chords_and_rhythms_separate`, but all the drums come from one Markov
+    chain over which drums sound on each sixteenth, so they stay in time together"""
+
+    midi = PrettyMIDI(in_file)
+
+    instrument = midi.instruments[0]
+
+    grid = midi_to_grid(notes_to_array(instrument.notes), midi.get_beats(), drum_pitches)
+
+    # Two beats of context, and as many sixteenths as there are chords below
+    markoved = generate_grid(99 * 16 - 8, 8, len(drum_pitches), grid)
+
+    out = PrettyMIDI()
+    drums = Instrument(program=42, is_drum=True, name='Drums')
+    drums.notes = array_to_notes(grid_to_note_array(markoved, drum_pitches, tempo=120))
+
+    matrix = parse_transition_matrix(f'{mood}.txt')
+    markoved_chords = generate_chords(matrix, M=100)
+
+    pitches = chords_to_midi_pitches(markoved_chords, tonic_midi=tonic, mood=mood)
+
+    chords = Instrument(program=0, is_drum=False, name='Chords')
+    chords.notes = make_midi_note_list(tempo=120, rhythm=['whole_note' for _ in range(99)], pitches=pitches)
+
+    out.instruments = [drums, chords]
+
+    out.write(out_file)
+
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,170 @@
+from typing import Dict, Iterator, List, Tuple
+from pretty_midi import Note
+import numpy as np
+
+
+# A single MIDI note packed into 18 bytes, as opposed to the several hundred a
+# `pretty_midi.Note` object (and its attribute dictionary) costs
+NOTE_DTYPE = np.dtype([
+    ('start', np.float64),
+    ('end', np.float64),
+    ('pitch', np.uint8),
+    ('velocity', np.uint8),
+])
+
+# Rhythm tokens are stored as one byte each. A token's code is
+# duration_index * len(KINDS) + kind_index, so 'quarter_tie' is 2 * 3 + 1 = 7
+DURATIONS = [
+    ('whole',        32),
+    ('half',         16),
+    ('quarter',       8),
+    ('eighth',        4),
+    ('sixteenth',     2),
+    ('thirty-second', 1),
+]
+
+KINDS = ('note', 'tie', 'rest')
+
+TOKEN_DTYPE = np.uint8
+
+TOKEN_NAMES = [
+    f'{duration_name}_{kind}' for duration_name, _ in DURATIONS for kind in KINDS
+]
+
+TOKEN_CODES = {name: code for code, name in enumerate(TOKEN_NAMES)}
+
+# Lookup tables indexed by token code
+TOKEN_SUBDIVS = np.array(
+    [subdivs for _, subdivs in DURATIONS for _ in KINDS], dtype=np.uint8
+)
+TOKEN_KINDS = np.array(
+    [kind for _ in DURATIONS for kind in range(len(KINDS))], dtype=np.uint8
+)
+
+
+def notes_to_array(midi_notes: List[Note]) -> np.ndarray:
+    """Packs a list of MIDI notes into a structured note array sorted by start time
+
+    Args:
+        midi_notes (List[Note]): the notes to pack
+
+    Returns:
+        np.ndarray: array of `NOTE_DTYPE`
+    """
+
+    array = np.fromiter(
+        ((n.start, n.end, n.pitch, n.velocity) for n in midi_notes),
+        dtype=NOTE_DTYPE,
+        count=len(midi_notes),
+    )
+
+    # Stable, so notes starting together keep their original order
+    return array[np.argsort(array['start'], kind='stable')]
+
+
+def array_to_notes(array: np.ndarray) -> List[Note]:
+    """Unpacks a structured note array back into `pretty_midi` notes
+
+    Args:
+        array (np.ndarray): array of `NOTE_DTYPE`
+
+    Returns:
+        List[Note]: one note per row of the array
+    """
+
+    return [
+        Note(velocity=int(velocity), pitch=int(pitch), start=float(start), end=float(end))
+        for start, end, pitch, velocity in array.tolist()
+    ]
+
+
+def group_by_pitch(array: np.ndarray) -> Dict[int, np.ndarray]:
+    """Splits a note array up by pitch
+
+    The array is sorted by pitch once; every group returned is a view into that
+    sorted copy, so no further copies are made no matter how many pitches there are.
+
+    Args:
+        array (np.ndarray): array of `NOTE_DTYPE`
+
+    Returns:
+        Dict[int, np.ndarray]: maps each pitch present to the notes of that pitch,
+        still in order of start time
+    """
+
+    by_pitch = array[np.argsort(array['pitch'], kind='stable')]
+
+    pitches, starts = np.unique(by_pitch['pitch'], return_index=True)
+    ends = np.append(starts[1:], len(by_pitch))
+
+    return {
+        int(pitch): by_pitch[start:end]
+        for pitch, start, end in zip(pitches, starts, ends)
+    }
+
+
+def encode_rhythm(rhythm: List[str]) -> np.ndarray:
+    """Converts a list of rhythm tokens such as 'quarter_note' into a token array
+
+    Args:
+        rhythm (List[str]): the tokens to convert
+
+    Returns:
+        np.ndarray: array of `TOKEN_DTYPE`
+    """
+
+    try:
+        return np.fromiter(
+            (TOKEN_CODES[token] for token in rhythm), dtype=TOKEN_DTYPE, count=len(rhythm)
+        )
+    except KeyError as e:
+        raise ValueError(f'unknown note {e.args[0]}') from None
+
+
+def decode_rhythm(tokens: np.ndarray) -> List[str]:
+    """Converts a token array back into a list of rhythm tokens
+
+    Args:
+        tokens (np.ndarray): array of `TOKEN_DTYPE`
+
+    Returns:
+        List[str]: the tokens as strings, e.g. 'quarter_note'
+    """
+
+    return [TOKEN_NAMES[code] for code in tokens.tolist()]
+
+
+def iter_rhythm(rhythm: List[str] | np.ndarray) -> Iterator[Tuple[int, str]]:
+    """Walks through a rhythm, in either representation, one token at a time
+
+    Args:
+        rhythm (List[str] | np.ndarray): list of tokens or a token array
+
+    Yields:
+        Tuple[int, str]: the duration of the token in subdivisions, and its kind
+        ('note', 'tie' or 'rest')
+    """
+
+    if isinstance(rhythm, np.ndarray):
+        subdivs = TOKEN_SUBDIVS[rhythm].tolist()
+        kinds = TOKEN_KINDS[rhythm].tolist()
+
+        for duration_subdivs, kind in zip(subdivs, kinds):
+            yield duration_subdivs, KINDS[kind]
+
+        return
+
+    durations = dict(DURATIONS)
+
+    for note in rhythm:
+        duration_name, kind = note.split('_')
+
+        try:
+            duration_subdivs = durations[duration_name]
+        except KeyError:
+            raise ValueError(f'unknown note {duration_name}') from None
+
+        if kind not in KINDS:
+            raise ValueError('invalid note type')
+
+        yield duration_subdivs, kind
@@ -0,0 +1,185 @@
+from bisect import bisect_right
+from collections import Counter
+from itertools import accumulate
+from typing import Hashable, List
+import numpy as np
+import random
+
+
+class OnlineModel:
+    """A Markov model, for rhythms or text, that can keep learning from new material
+    without recounting what it has already seen.
+
+    Counts are kept per k-tuple like in `collect_counts`, but as weights: each call
+    to `update` can first multiply every existing weight by `decay`, so that older
+    material counts for less. Rather than touching every weight, new counts are
+    added with a weight of 1 / decay^n after n updates, which comes to the same
+    thing.
+
+    Sampling uses a cumulative table per k-tuple, which is only rebuilt the next
+    time that k-tuple is sampled from after it gained followers.
+    """
+
+    # Once new counts weigh this much, every weight is scaled back down
+    MAX_SCALE = 1e100
+
+    def __init__(self, k: int, decay: float = 1.0):
+        """
+        Args:
+            k (int): order of the model
+            decay (float, optional): how much each update shrinks the weight of
+            everything seen before it, between 0 and 1. Defaults to 1, no decay.
+        """
+
+        if not 0 < decay <= 1:
+            raise ValueError('decay must be greater than 0 and at most 1')
+
+        self.k = k
+        self.decay = decay
+        self.scale = 1.0
+
+        # k-tuple -> follower -> weight
+        self.weights = {}
+
+        # k-tuple -> (followers, cumulative weights), for the k-tuples not in `stale`
+        self.tables = {}
+        self.stale = set()
+
+        # The last k tokens of the previous update, to continue from, or None if
+        # they aren't known
+        self.tail = []
+
+    @classmethod
+    def from_counts(cls, counts: dict, k: int, decay: float = 1.0, tail: List[Hashable] | str | None = None):
+        """Starts a model from one trained by `collect_counts` in rhythm.py or
+        language.py
+
+        Args:
+            counts (dict): the model, as returned by `collect_counts`
+            k (int): order of the model
+            decay (float, optional): see `__init__`. Defaults to 1.
+            tail (List[Hashable] | str, optional): the last k tokens the counts
+            were collected from, e.g. `contents[-k:]`, so that the first update can
+            continue from them. Without it, that update can't continue.
+
+        Returns:
+            OnlineModel: the model
+        """
+
+        model = cls(k, decay)
+        model.tail = list(tail[max(len(tail) - k, 0):]) if tail is not None else None
+
+        for k_tuple, entry in counts.items():
+            model.weights[k_tuple] = {
+                follower: float(count) for follower, count in entry['followers'].items()
+            }
+            model.stale.add(k_tuple)
+
+        return model
+
+    def update(self, tokens: List[Hashable] | str | np.ndarray, continues: bool = False):
+        """Learns from new material, in time proportional to its length
+
+        Args:
+            tokens (List[Hashable] | str | np.ndarray): the new rhythm tokens (as a
+            list or token array) or text
+            continues (bool, optional): whether the material carries straight on
+            from that of the previous update, e.g. the next chapter of a book, so
+            the k-tuples running across the two are counted too. Defaults to False.
+        """
+
+        if isinstance(tokens, np.ndarray):
+            tokens = tokens.tolist()
+
+        is_text = isinstance(tokens, str)
+
+        if continues:
+            if self.tail is None:
+                raise ValueError('the material the model was trained on is unknown, so nothing can continue it')
+
+            tokens = self.tail + tokens if not is_text else ''.join(self.tail) + tokens
+
+        if self.decay < 1:
+            self.scale /= self.decay
+
+        # Count the new material on its own first, like `collect_counts`
+        new_counts = Counter()
+        for start_idx in range(len(tokens) - self.k):
+            k_tuple = tokens[start_idx:start_idx + self.k]
+            if not is_text:
+                k_tuple = tuple(k_tuple)
+
+            new_counts[k_tuple, tokens[start_idx + self.k]] += 1
+
+        # Then merge it in
+        for (k_tuple, follower), count in new_counts.items():
+            followers = self.weights.setdefault(k_tuple, {})
+            followers[follower] = followers.get(follower, 0.0) + count * self.scale
+            self.stale.add(k_tuple)
+
+        self.tail = list(tokens[max(len(tokens) - self.k, 0):])
+
+        if self.scale > self.MAX_SCALE:
+            self._rescale()
+
+    def _rescale(self):
+        """Divides every weight by the current scale, so they don't overflow"""
+
+        for followers in self.weights.values():
+            for follower in followers:
+                followers[follower] /= self.scale
+
+        self.scale = 1.0
+
+        # Every table changed by the same factor, but it's simplest to rebuild them
+        self.stale.update(self.tables)
+        self.tables.clear()
+
+    def next_token(self, k_tuple) -> Hashable:
+        """Randomly selects the token following a k-tuple, in proportion to the
+        weights of its followers
+
+        Args:
+            k_tuple: the previous k tokens, as a tuple, or a string for text
+
+        Returns:
+            the next token
+        """
+
+        if k_tuple in self.stale or k_tuple not in self.tables:
+            followers = self.weights[k_tuple]
+            self.tables[k_tuple] = (list(followers), list(accumulate(followers.values())))
+            self.stale.discard(k_tuple)
+
+        followers, cumulative = self.tables[k_tuple]
+
+        number = random.random() * cumulative[-1]
+
+        return followers[min(bisect_right(cumulative, number), len(followers) - 1)]
+
+    def generate(self, M: int, seed: List[Hashable] | str) -> List[Hashable] | str:
+        """Generates M tokens following the first k tokens of the seed
+
+        Args:
+            M (int): number of tokens to generate
+            seed (List[Hashable] | str): tokens or text to start from
+
+        Returns:
+            List[Hashable] | str: the first k tokens of the seed followed by M
+            generated ones, as a string if the seed was one
+        """
+
+        if isinstance(seed, str):
+            text = seed[0:self.k]
+
+            for _ in range(M):
+                text += self.next_token(text[len(text) - self.k:])
+
+            return text
+
+        text = list(seed[0:self.k])
+
+        for _ in range(M):
+            text.append(self.next_token(tuple(text[len(text) - self.k:])))
+
+        return text
@@ -1,37 +1,62 @@
 from typing import List, Tuple
 from pretty_midi import Note
+import numpy as np
 import random
 
+from notes import DURATIONS, TOKEN_CODES, TOKEN_DTYPE, decode_rhythm, notes_to_array
 
-def midi_to_list(midi_notes: List[Note], beats: List[float]) -> Tuple[List[str], List[int]]:
+
+def midi_to_list(midi_notes: List[Note] | np.ndarray, beats: List[float]) -> Tuple[List[str], List[int]]:
     """Converts a list of MIDI notes into a list of MIDI pitches and a rhythm list
 
     Args:
-        midi_notes (List[Note]): the list of notes to convert
+        midi_notes (List[Note] | np.ndarray): the list of notes to convert
         beats (List[float]): list of beats used to interpret the rhythm
 
     Returns:
         Tuple[List[str], List[int]]: list of rhythms, and list of MIDI pitches
     """
 
+    tokens, pitches = midi_to_array(midi_notes, beats)
+
+    return decode_rhythm(tokens), pitches.tolist()
+
+
+def midi_to_array(midi_notes: List[Note] | np.ndarray, beats: List[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Converts MIDI notes into a rhythm token array and an array of MIDI pitches.
+    This is `midi_to_list` without the Python lists, see `notes.py`.
+
+    Args:
+        midi_notes (List[Note] | np.ndarray): the notes to convert, either as
+        `pretty_midi` notes or as a note array
+        beats (List[float]): list of beats used to interpret the rhythm
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: rhythm token array, and array of MIDI pitches
+    """
+
+    if isinstance(midi_notes, np.ndarray):
+        notes = midi_notes[np.argsort(midi_notes['start'], kind='stable')]
+    else:
+        notes = notes_to_array(midi_notes)
+
     next_beat = 1
 
-    notes = sorted(midi_notes, key=lambda n: n.start)
+    starts = notes['start'].tolist()
+    ends = notes['end'].tolist()
     parsed_notes = []
-    parsed_pitches = []
+
+    # Every note but the last one gets parsed
+    parsed_pitches = notes['pitch'][:-1].copy()
 
     for n in range(1, len(notes)):
 
         # Get the start time of two consecutive notes
-        prev_note_start = notes[n-1].start
-        current_note_start = notes[n].start
-
-        # Parse out the pitch
-        pitch = notes[n-1].pitch
-        parsed_pitches.append(pitch)
+        prev_note_start = starts[n-1]
+        current_note_start = starts[n]
 
         # Find the duration
-        note_dur = notes[n-1].end - notes[n-1].start
+        note_dur = ends[n-1] - starts[n-1]
 
         # Find the time between the two notes
         note_gap = current_note_start - prev_note_start
@@ -47,15 +72,15 @@ def midi_to_list(midi_notes: List[Note], beats: List[float]) -> Tuple[List[str],
         gap_beats = note_gap / beat_length
         dur_beats = note_dur / beat_length
 
-        start_subd = get_best_subdivision(prev_note_start, 8)
         gap_subd = get_best_subdivision(gap_beats, 8)
         beats_subd = get_best_subdivision(dur_beats, 8)
 
-        parsed_notes += fill_gap(gap_subd, beats_subd)
+        parsed_notes += [TOKEN_CODES[token] for token in fill_gap(gap_subd, beats_subd)]
 
-    parsed_notes = [n for n in parsed_notes if n != 'whole_rest']
+    tokens = np.array(parsed_notes, dtype=TOKEN_DTYPE)
+    tokens = tokens[tokens != TOKEN_CODES['whole_rest']]
 
-    return parsed_notes, parsed_pitches
+    return tokens, parsed_pitches
 
 
 def get_best_subdivision(num: float, num_subdivisions: int) -> int:
@@ -115,14 +140,7 @@ def fill_gap(gap_length: int, note_length: int) -> List[str]:
 
     rest_length = gap_length - note_length
 
-    names_and_subdivs = [
-        ('whole',        32),
-        ('half',         16),
-        ('quarter',       8),
-        ('eighth',        4),
-        ('sixteenth',     2),
-        ('thirty-second', 1)
-    ]
+    names_and_subdivs = DURATIONS
 
     # Get the first note
     first_note_name, first_note_subdiv = choose_note(note_length, names_and_subdivs)
@@ -186,18 +204,27 @@ def collect_counts(contents: list, k):
     return counts
      
 
-def generate_rhythm(M: int, k: int, seed: List[str]) -> List[str]:
+def generate_rhythm(M: int, k: int, seed: List[str] | np.ndarray) -> List[str] | np.ndarray:
     """Generates a rhythm designed to continue that which is passed as a seed
 
     Args:
         M (int): the number of elements in the continuation
         k (int): order of the Markov chain used to generate the rhythm
-        seed (List[str]): element on which the Markov model is trained
+        seed (List[str] | np.ndarray): element on which the Markov model is trained,
+        either a list of tokens or a token array
 
     Returns:
-        List[str]: generated text, which will be of length M
+        List[str] | np.ndarray: generated text, which will be of length M, in the
+        same representation as the seed
     """
-    
+
+    # Token arrays are trained on as plain integer codes, which hash faster than
+    # NumPy scalars
+    token_dtype = None
+    if isinstance(seed, np.ndarray):
+        token_dtype = seed.dtype
+        seed = seed.tolist()
+
     counts = collect_counts(seed, k)
 
     # Generate artificial text from the trained model
@@ -230,4 +257,7 @@ def generate_rhythm(M: int, k: int, seed: List[str]) -> List[str]:
 
         seed = tuple(text[-k:])
 
+    if token_dtype is not None:
+        return np.array(text, dtype=token_dtype)
+
     return text
@@ -0,0 +1,380 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from typing import List
+from pretty_midi import PrettyMIDI, Instrument
+import numpy as np
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import time
+
+from chords import parse_transition_matrix, generate_chords_batch, chords_to_midi_pitches
+from drums import midi_to_grid, collect_grid_counts, sample_grid, grid_to_note_array
+from filegen import make_midi_note_list, make_wav
+from notes import notes_to_array, array_to_notes
+
+
+# Same settings as `chords_and_rhythms_joint` in main.py
+DRUM_FILE = 'simple_drum_beats.mid'
+DRUM_PITCHES = [35, 38, 42]
+DRUM_ORDER = 8
+TEMPO = 120
+
+# Longest progression one request may ask for, in chords
+MAX_LENGTH = 1000
+
+# The highest note of any chord is 19 half steps above the tonic, and MIDI pitches
+# only go up to 127
+MAX_TONIC = 127 - 19
+
+FORMATS = {
+    'json': 'application/json',
+    'midi': 'audio/midi',
+    'wav': 'audio/wav',
+}
+
+
+def encode_midi(chords: List[List[int]], drum_notes: np.ndarray | None) -> bytes:
+    """Writes chords, each lasting a whole note, and optionally drums to a MIDI file
+
+    Args:
+        chords (List[List[int]]): MIDI pitches of each chord, perhaps outputted by
+        `chords_to_midi_pitches`
+        drum_notes (np.ndarray | None): note array of the drums, or None for no drums
+
+    Returns:
+        bytes: contents of the MIDI file
+    """
+
+    out = PrettyMIDI()
+
+    instrument = Instrument(program=0, is_drum=False, name='Chords')
+    instrument.notes = make_midi_note_list(
+        tempo=TEMPO, rhythm=['whole_note' for _ in chords], pitches=chords
+    )
+    out.instruments.append(instrument)
+
+    if drum_notes is not None:
+        drums = Instrument(program=42, is_drum=True, name='Drums')
+        drums.notes = array_to_notes(drum_notes)
+        out.instruments.append(drums)
+
+    f = io.BytesIO()
+    out.write(f)
+
+    return f.getvalue()
+
+
+_drum_counts = None
+_drum_start = None
+
+
+def _init_worker(drum_counts: dict | None, drum_start: np.ndarray | None):
+    """Gives each worker process its own copy of the drum model, once"""
+
+    global _drum_counts, _drum_start
+    _drum_counts = drum_counts
+    _drum_start = drum_start
+
+
+def sample_drum_notes(length: int) -> np.ndarray:
+    """Samples drums to go under `length` chords, each lasting a whole note. Runs in
+    a worker process, as it's a pure Python loop over every sixteenth.
+
+    Returns:
+        np.ndarray: note array of the drums
+    """
+
+    # One chord lasts a whole note, which is 16 sixteenths
+    grid = sample_grid(
+        16 * length - DRUM_ORDER, DRUM_ORDER, len(DRUM_PITCHES), _drum_counts, _drum_start
+    )
+
+    return grid_to_note_array(grid, DRUM_PITCHES, tempo=TEMPO)
+
+
+def encode_wav(chords: List[List[int]]) -> bytes:
+    """Renders chords, each lasting a whole note, to a WAV file
+
+    Args:
+        chords (List[List[int]]): MIDI pitches of each chord
+
+    Returns:
+        bytes: contents of the WAV file
+    """
+
+    f = io.BytesIO()
+    make_wav(tempo=TEMPO, file_name=f, rhythm=['whole_note' for _ in chords], pitches=chords)
+
+    return f.getvalue()
+
+
+class GenerationServer:
+    """Keeps trained models in memory and answers generation requests over HTTP.
+
+    Requests are JSON objects POSTed to /generate, for example
+        {"mood": "minor", "tonic": 51, "length": 16, "format": "midi", "drums": true}
+    Requests arriving within `batch_window` seconds of each other are sampled
+    together with `generate_chords_batch`. MIDI and WAV encoding runs in a pool of
+    worker processes. GET /stats returns latency percentiles.
+    """
+
+    def __init__(self, batch_window: float = 0.005, max_batch: int = 64, workers: int | None = None):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+
+        self.matrices = {
+            mood: parse_transition_matrix(f'{mood}.txt') for mood in ('major', 'minor')
+        }
+
+        # The drums are optional, since the MIDI file they're trained on might not
+        # be around
+        self.drum_counts = None
+        self.drum_start = None
+        if os.path.exists(DRUM_FILE):
+            midi = PrettyMIDI(DRUM_FILE)
+            grid = midi_to_grid(
+                notes_to_array(midi.instruments[0].notes), midi.get_beats(), DRUM_PITCHES
+            )
+            self.drum_counts = collect_grid_counts(grid, DRUM_ORDER, len(DRUM_PITCHES))
+            self.drum_start = grid[:DRUM_ORDER]
+
+        self.rng = np.random.default_rng()
+
+        # Forking workers on demand would hand them copies of the open client
+        # sockets, which then never see EOF when the server closes them
+        self.pool = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context('forkserver'),
+            initializer=_init_worker,
+            initargs=(self.drum_counts, self.drum_start),
+        )
+        self.queue = asyncio.Queue()
+        self.latencies = deque(maxlen=10000)
+        self.tasks = set()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8000, unix: str | None = None):
+        batcher = asyncio.create_task(self.run_batches())
+
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.pool.shutdown()
+
+    async def generate(self, request: dict) -> bytes:
+        """Checks a request, queues it for the next batch and waits for its result"""
+
+        if not isinstance(request, dict):
+            raise ValueError('request must be a JSON object')
+
+        mood = request.get('mood', 'major')
+        if mood not in self.matrices:
+            raise ValueError(f'unknown mood {mood}')
+
+        output_format = request.get('format', 'json')
+        if output_format not in FORMATS:
+            raise ValueError(f'unknown format {output_format}')
+
+        length = int(request.get('length', 16))
+        if not 1 <= length <= MAX_LENGTH:
+            raise ValueError(f'length must be from 1 to {MAX_LENGTH}')
+
+        tonic = int(request.get('tonic', 48))
+        if not 0 <= tonic <= MAX_TONIC:
+            raise ValueError(f'tonic must be from 0 to {MAX_TONIC}')
+
+        drums = bool(request.get('drums', False))
+        if drums and self.drum_counts is None:
+            raise ValueError(f'drums are unavailable without {DRUM_FILE}')
+        if drums and output_format == 'wav':
+            raise ValueError('drums can only be rendered as json or midi')
+
+        params = {
+            'mood': mood,
+            'format': output_format,
+            'length': length,
+            'tonic': tonic,
+            'drums': drums,
+        }
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((params, future))
+
+        return await future
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+
+            # Wait for one request, then give others a short while to join it
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+
+            # Requests sharing a mood share a transition matrix, so they can be
+            # sampled in one go
+            by_mood = {}
+            for params, future in batch:
+                by_mood.setdefault(params['mood'], []).append((params, future))
+
+            for mood, group in by_mood.items():
+                lengths = [params['length'] for params, _ in group]
+                sequences = generate_chords_batch(
+                    self.matrices[mood], max(lengths) - 1, len(group), self.rng
+                )
+
+                for (params, future), sequence, length in zip(group, sequences, lengths):
+                    task = asyncio.create_task(
+                        self.finish(params, future, sequence[:length].tolist())
+                    )
+
+                    # The event loop only keeps weak references to tasks
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+
+    async def finish(self, params: dict, future: asyncio.Future, chord_sequence: List[int]):
+        """Encodes one sampled request, as checked by `generate`, in the requested format"""
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            output_format = params['format']
+            pitches = chords_to_midi_pitches(
+                chord_sequence, tonic_midi=params['tonic'], mood=params['mood']
+            )
+
+            drum_notes = None
+            if params['drums']:
+                drum_notes = await loop.run_in_executor(
+                    self.pool, sample_drum_notes, len(chord_sequence)
+                )
+
+            if output_format == 'json':
+                result = {'chords': chord_sequence, 'pitches': pitches}
+                if drum_notes is not None:
+                    result['drums'] = [
+                        {'start': start, 'pitch': pitch}
+                        for start, _, pitch, _ in drum_notes.tolist()
+                    ]
+                body = json.dumps(result).encode()
+            elif output_format == 'midi':
+                body = await loop.run_in_executor(self.pool, encode_midi, pitches, drum_notes)
+            else:
+                body = await loop.run_in_executor(self.pool, encode_wav, pitches)
+
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        if not future.done():
+            future.set_result(body)
+
+    def stats(self) -> dict:
+        """Latency percentiles, in milliseconds, of the most recent requests"""
+
+        if not self.latencies:
+            return {'requests': 0}
+
+        p50, p90, p99 = np.percentile(self.latencies, [50, 90, 99])
+
+        return {
+            'requests': len(self.latencies),
+            'p50_ms': p50 * 1000,
+            'p90_ms': p90 * 1000,
+            'p99_ms': p99 * 1000,
+        }
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+            # Read the headers, of which we only care about the length of the body
+            content_length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    content_length = int(value)
+
+            body = await reader.readexactly(content_length)
+
+            if method == 'GET' and path == '/stats':
+                await self.respond(writer, 200, json.dumps(self.stats()).encode(), FORMATS['json'])
+
+            elif method == 'POST' and path == '/generate':
+                start = time.perf_counter()
+
+                try:
+                    request = json.loads(body)
+                    result = await self.generate(request)
+                except (ValueError, TypeError) as e:
+                    await self.respond(writer, 400, json.dumps({'error': str(e)}).encode(), FORMATS['json'])
+                    return
+                except Exception as e:
+                    await self.respond(writer, 500, json.dumps({'error': str(e)}).encode(), FORMATS['json'])
+                    return
+
+                self.latencies.append(time.perf_counter() - start)
+                await self.respond(writer, 200, result, FORMATS[request.get('format', 'json')])
+
+            else:
+                await self.respond(writer, 404, b'{"error": "not found"}', FORMATS['json'])
+
+        except (ValueError, asyncio.IncompleteReadError):
+            await self.respond(writer, 400, b'{"error": "malformed request"}', FORMATS['json'])
+
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+        head = (
+            f'HTTP/1.1 {status} {reasons[status]}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: close\r\n'
+            '\r\n'
+        )
+
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def run_server(args: argparse.Namespace):
+    server = GenerationServer(batch_window=args.batch_window / 1000, workers=args.workers)
+    await server.serve(args.host, args.port, args.unix)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve chord and drum generation over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', help='listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--batch-window', type=float, default=5, help='in milliseconds')
+    parser.add_argument('--workers', type=int, help='number of encoding processes')
+
+    asyncio.run(run_server(parser.parse_args()))
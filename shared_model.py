@@ -0,0 +1,267 @@
+from multiprocessing import shared_memory
+from typing import Hashable, List, Tuple
+import multiprocessing
+import numpy as np
+
+from chord_model import build_csr_table, sample_csr_row
+
+
+class SharedModel:
+    """A Markov model trained by `collect_counts` (from rhythm.py or language.py),
+    flattened into arrays that live in shared memory, so that any number of worker
+    processes can sample from one copy of it.
+
+    The arrays are built by `build_csr_table`, so they have the same layout as the
+    tables of `ChordModel`: `contexts` holds every k-tuple, packed into an integer
+    by reading the indices of its tokens in the vocabulary as a number in base
+    len(vocabulary), in order. The followers of contexts[i] are
+    followers[indptr[i]:indptr[i + 1]], and `cumulative` holds the running total
+    of their counts.
+
+    The process that calls `create` owns the memory and must `unlink` it once every
+    worker is done. Workers get their copy by passing `handle()` to `attach`, which
+    copies nothing.
+    """
+
+    ARRAYS = ('contexts', 'indptr', 'followers', 'cumulative')
+
+    def __init__(self, shm: shared_memory.SharedMemory, vocabulary: List[Hashable], k: int, layout: list):
+        self.shm = shm
+        self.vocabulary = vocabulary
+        self.k = k
+        self.layout = layout
+        self.index = {token: i for i, token in enumerate(vocabulary)}
+
+        for name, dtype, offset, length in layout:
+            setattr(self, name, np.ndarray((length,), dtype=dtype, buffer=shm.buf, offset=offset))
+
+    @classmethod
+    def create(cls, counts: dict, k: int):
+        """Copies a model into a new block of shared memory
+
+        Args:
+            counts (dict): the model, as returned by `collect_counts`
+            k (int): the order of the model
+
+        Returns:
+            SharedModel: the model, owning the shared memory
+        """
+
+        vocabulary = list(dict.fromkeys(
+            token for k_tuple, entry in counts.items()
+            for token in (*k_tuple, *entry['followers'])
+        ))
+        index = {token: i for i, token in enumerate(vocabulary)}
+        size = len(vocabulary)
+
+        if size ** (k + 1) >= 2 ** 63:
+            raise ValueError(f'{k}-tuples of {size} tokens do not fit in 63 bits')
+
+        # Pack each k-tuple together with each of its followers
+        pairs = []
+        pair_counts = []
+
+        for k_tuple, entry in counts.items():
+            context = 0
+            for token in k_tuple:
+                context = context * size + index[token]
+
+            for follower, follower_count in entry['followers'].items():
+                pairs.append(context * size + index[follower])
+                pair_counts.append(follower_count)
+
+        pairs = np.array(pairs, dtype=np.int64)
+        order = np.argsort(pairs)
+        pairs = pairs[order]
+
+        table = build_csr_table(pairs // size, pairs % size, np.array(pair_counts, dtype=np.float64)[order])
+        arrays = dict(zip(cls.ARRAYS, table))
+
+        # Lay the arrays out one after another, each aligned to 8 bytes
+        layout = []
+        offset = 0
+        for name in cls.ARRAYS:
+            layout.append((name, arrays[name].dtype.str, offset, len(arrays[name])))
+            offset += -(-arrays[name].nbytes // 8) * 8
+
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        model = cls(shm, vocabulary, k, layout)
+
+        for name in cls.ARRAYS:
+            getattr(model, name)[:] = arrays[name]
+
+        return model
+
+    def handle(self) -> Tuple[str, List[Hashable], int, list]:
+        """Everything `attach` needs to find the model, small enough to pickle cheaply"""
+
+        return self.shm.name, self.vocabulary, self.k, self.layout
+
+    @classmethod
+    def attach(cls, handle: Tuple[str, List[Hashable], int, list]):
+        """Attaches to a model created by another process, without copying it
+
+        Args:
+            handle: the result of `handle()` on the model
+
+        Returns:
+            SharedModel: read-only view of the model
+        """
+
+        name, vocabulary, k, layout = handle
+
+        # Only the creating process should clean the memory up. Before Python 3.13
+        # there's no opting out of tracking, but processes started by
+        # multiprocessing share their parent's resource tracker, so that's harmless.
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+
+        model = cls(shm, vocabulary, k, layout)
+
+        for array_name in cls.ARRAYS:
+            getattr(model, array_name).flags.writeable = False
+
+        return model
+
+    def nbytes(self) -> int:
+        """Memory used by the arrays, in bytes"""
+
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def next_token(self, k_tuple) -> Hashable:
+        """Same as `generate_next_character` in language.py, for any k-tuple"""
+
+        size = len(self.vocabulary)
+
+        context = 0
+        for token in k_tuple:
+            context = context * size + self.index[token]
+
+        follower = sample_csr_row((self.contexts, self.indptr, self.followers, self.cumulative), context)
+        if follower is None:
+            raise KeyError(k_tuple)
+
+        return self.vocabulary[follower]
+
+    def generate(self, M: int, seed: List[Hashable]) -> List[Hashable]:
+        """Generates M tokens following the first k tokens of the seed
+
+        Args:
+            M (int): number of tokens to generate
+            seed (List[Hashable]): tokens to start from, such as the text or rhythm
+            the model was trained on
+
+        Returns:
+            List[Hashable]: the first k tokens of the seed followed by M generated ones
+        """
+
+        text = list(seed[0:self.k])
+
+        for _ in range(M):
+            text.append(self.next_token(text[len(text) - self.k:]))
+
+        return text
+
+    def close(self):
+        """Detaches this process from the shared memory"""
+
+        for name in self.ARRAYS:
+            delattr(self, name)
+
+        self.shm.close()
+
+    def unlink(self):
+        """Frees the shared memory. Only the process that called `create` should."""
+
+        self.shm.unlink()
+
+
+def private_memory_kb() -> int:
+    """Memory only this process is using, in kilobytes, i.e. not counting pages
+    shared with other processes. Only works on Linux."""
+
+    total = 0
+
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                total += int(line.split()[1])
+
+    return total
+
+
+_worker_model = None
+
+
+def _attach_worker(handle):
+    global _worker_model
+    _worker_model = SharedModel.attach(handle)
+
+
+def _sample_shared(seed):
+    _worker_model.generate(1000, seed)
+    return private_memory_kb()
+
+
+def _sample_pickled(counts, k, seed):
+    from language import generate_next_character
+
+    text = seed[0:k]
+    for _ in range(1000):
+        text += generate_next_character(text[len(text) - k:], counts)
+    return private_memory_kb()
+
+
+def measure_memory(model: SharedModel, counts: dict, seed, workers: int) -> Tuple[float, float]:
+    """Samples from a model in a pool of workers, first attached to the shared
+    model and then each sent its own pickled copy of the counts
+
+    Args:
+        model (SharedModel): the model, created from counts
+        counts (dict): the model, as returned by `collect_counts`
+        seed: tokens to start sampling from
+        workers (int): number of worker processes
+
+    Returns:
+        Tuple[float, float]: average private memory of a worker in kilobytes,
+        with the shared model and with a pickled copy
+    """
+
+    with multiprocessing.Pool(workers, _attach_worker, (model.handle(),)) as pool:
+        shared = pool.map(_sample_shared, [seed] * workers, chunksize=1)
+
+    with multiprocessing.Pool(workers) as pool:
+        pickled = pool.starmap(_sample_pickled, [(counts, model.k, seed)] * workers, chunksize=1)
+
+    return sum(shared) / workers, sum(pickled) / workers
+
+
+def compare_memory(file_name: str, k: int = 4, max_workers: int = 8):
+    """Prints how much private memory each worker ends up using to sample from a
+    text model, when the model is shared versus when each worker is sent its own
+    copy. The shared figure stays flat however many workers there are, and the
+    total of the pickled one grows with each worker."""
+
+    from language import collect_counts_from_file
+
+    counts, seed = collect_counts_from_file(file_name, k)
+    model = SharedModel.create(counts, k)
+
+    print(f'model: {len(counts)} {k}-tuples, {model.nbytes() // 1024} kB of arrays')
+    print('workers\tshared kB/worker\tpickled kB/worker')
+
+    try:
+        workers = 1
+        while workers <= max_workers:
+            shared, pickled = measure_memory(model, counts, seed, workers)
+            print(f'{workers}\t{shared:.0f}\t\t\t{pickled:.0f}')
+            workers *= 2
+    finally:
+        model.close()
+        model.unlink()
+
+
+if __name__ == '__main__':
+    compare_memory('tidy_heart_of_darkness.txt')
@@ -0,0 +1,62 @@
+import random
+import pytest
+
+from language import collect_counts
+from shared_model import SharedModel, measure_memory, private_memory_kb
+
+
+# Allowed drift in a worker's private memory as workers are added, in kilobytes
+TOLERANCE_KB = 2048
+
+
+@pytest.fixture(scope='module')
+def text_model():
+    try:
+        private_memory_kb()
+    except OSError:
+        pytest.skip('private memory can only be measured on Linux')
+
+    # Random words give lots of distinct 4-tuples, so that a pickled copy of the
+    # counts is tens of megabytes
+    rng = random.Random(0)
+    words = [
+        ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9)))
+        for _ in range(5000)
+    ]
+    contents = ' '.join(rng.choice(words) for _ in range(200000))
+
+    counts = collect_counts(contents, 4)
+    model = SharedModel.create(counts, 4)
+
+    yield model, counts, contents
+
+    model.close()
+    model.unlink()
+
+
+def test_generate_matches_counts(text_model):
+    model, counts, contents = text_model
+
+    text = model.generate(200, contents)
+
+    for start_idx in range(len(text) - 4):
+        k_tuple = ''.join(text[start_idx:start_idx + 4])
+        assert text[start_idx + 4] in counts[k_tuple]['followers']
+
+
+def test_worker_memory_stays_flat(text_model):
+    model, counts, contents = text_model
+
+    measurements = {workers: measure_memory(model, counts, contents, workers) for workers in (1, 2, 4)}
+    shared = [shared for shared, _ in measurements.values()]
+    pickled = [pickled for _, pickled in measurements.values()]
+
+    # Attaching to the shared model costs each worker about the same, small, amount
+    # however many workers there are
+    assert max(shared) - min(shared) < TOLERANCE_KB
+
+    # Whereas every worker given a pickled copy pays for the whole model again, so
+    # the total grows by at least the size of the arrays with each worker
+    model_kb = model.nbytes() / 1024
+    for shared_kb, pickled_kb in zip(shared, pickled):
+        assert pickled_kb - shared_kb > max(model_kb, 4 * TOLERANCE_KB)